@@ -1,5 +1,22 @@
 from docassemble.base.util import log, word, DADict, DAList, DAObject, DAFile, DAFileCollection, DAFileList, defined, value, pdf_concatenate, DAOrderedDict, action_button_html, include_docx_template
+from docassemble.base.functions import this_thread, get_user_dict
+from docassemble.base.pandoc import word_to_pdf
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import ast
+import itertools
+import os
 import re
+import shutil
+import tempfile
+try:
+  import pikepdf
+except ImportError:
+  pikepdf = None
+
+# Set to False to always use docassemble's pdf_concatenate() (pdftk) when
+# combining documents
+use_fast_concatenate = True
 
 def label(dictionary):
   try:
@@ -24,6 +41,430 @@ def safeattr(object, key):
   except:
     return ""
   
+_request_ids = itertools.count()
+
+def _step_cache():
+  """
+  Return a dictionary that only lives for the current request. It is tied to
+  the thread's current_info, which docassemble replaces on every request, so
+  nothing cached here is pickled into the interview answers. The previous
+  request's values are dropped as soon as a new request asks for the cache.
+  """
+  info = this_thread.current_info
+  # Mark the request with a plain number instead of holding on to
+  # current_info itself
+  request_id = info.get('aldocument_request')
+  if request_id is None:
+    request_id = next(_request_ids)
+    info['aldocument_request'] = request_id
+  cache = getattr(this_thread, 'aldocument_step_cache', None)
+  if cache is None:
+    cache = this_thread.aldocument_step_cache = dict()
+  if cache.get('request') != request_id:
+    cache.clear()
+    cache['request'] = request_id
+  return cache
+
+# Returned by _lookup_field() for variables that are not defined yet
+_undefined = object()
+# Returned by a compiled name when only docassemble can tell if it is defined
+_unknown = object()
+
+_name_head = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+_name_step = re.compile(r"\.([A-Za-z_][A-Za-z0-9_]*)|\[\s*(-?[0-9]+|'[^'\\]*'|\"[^\"\\]*\")\s*\]")
+# field_name -> resolver function, or None if the name is not a plain chain of
+# attributes and literal indexes. Kept at module level because closures
+# cannot be pickled with the interview answers.
+_compiled_names = dict()
+
+def _compile_name(field_name):
+  """
+  Parse a variable name like `users[0].name.first` once, and return a function
+  that looks it up in the interview answers without triggering any questions.
+  The function returns the value, _undefined, or _unknown. Returns None if
+  the name is too complex to parse, e.g. it uses an index variable like `i`.
+  """
+  head = _name_head.match(field_name)
+  if not head:
+    return None
+  root = head.group(0)
+  steps = []
+  pos = head.end()
+  while pos < len(field_name):
+    step = _name_step.match(field_name, pos)
+    if not step:
+      return None
+    if step.group(1) is not None:
+      steps.append((True, step.group(1)))
+    else:
+      steps.append((False, ast.literal_eval(step.group(2))))
+    pos = step.end()
+
+  def resolve(user_dict):
+    if root not in user_dict:
+      return _undefined
+    obj = user_dict[root]
+    for is_attribute, step in steps:
+      if is_attribute:
+        attributes = getattr(obj, '__dict__', None)
+        if attributes is not None and step in attributes:
+          obj = attributes[step]
+        elif hasattr(type(obj), step):
+          # A property or method: let docassemble evaluate it
+          return _unknown
+        else:
+          return _undefined
+      else:
+        container = obj.elements if isinstance(obj, (DADict, DAList)) else obj
+        try:
+          obj = container[step]
+        except (KeyError, IndexError):
+          return _undefined
+        except Exception:
+          return _unknown
+    return obj
+  return resolve
+
+def _user_dict():
+  """
+  Return the interview answers, looked up once per request.
+  """
+  cache = _step_cache()
+  if 'user_dict' not in cache:
+    user_dict = get_user_dict()
+    # Only trust something that really is the interview answers
+    if not (isinstance(user_dict, dict) and '_internal' in user_dict):
+      user_dict = None
+    cache['user_dict'] = user_dict
+  return cache['user_dict']
+
+@contextmanager
+def _value_pass():
+  """
+  Remember the values _lookup_field() resolves until the outermost pass ends,
+  e.g. for one overflow check or one as_pdf() call. Passes nest.
+  """
+  cache = _step_cache()
+  outermost = 'values' not in cache
+  if outermost:
+    cache['values'] = dict()
+  try:
+    yield
+  finally:
+    if outermost:
+      cache.pop('values', None)
+
+def _lookup_field(field_name):
+  """
+  Return the value of the docassemble variable field_name, or _undefined.
+  
+  Inside a _value_pass(), defined values of plain names (see _compile_name())
+  are cached until the pass ends. Other names, e.g. `names[i]`, can mean
+  something different on every call, so they are always evaluated fresh.
+  """
+  if field_name not in _compiled_names:
+    _compiled_names[field_name] = _compile_name(field_name)
+  resolve = _compiled_names[field_name]
+  if resolve is not None:
+    cache = _step_cache().get('values')
+    if cache is None:
+      # Outside a pass: nothing to remember the value in
+      cache = dict()
+    elif field_name in cache:
+      return cache[field_name]
+    user_dict = _user_dict()
+    if user_dict is not None:
+      field_value = resolve(user_dict)
+      if field_value is not _unknown:
+        if field_value is not _undefined:
+          cache[field_name] = field_value
+        return field_value
+    if defined(field_name):
+      cache[field_name] = value(field_name)
+      return cache[field_name]
+    return _undefined
+  if defined(field_name):
+    return value(field_name)
+  return _undefined
+
+def _single_file(item):
+  """
+  Return the DAFile behind a file-like item (DAFile, DAFileCollection or
+  single-item DAFileList), preferring the PDF version, or None.
+  """
+  if isinstance(item, DAFileCollection):
+    item = getattr(item, 'pdf', None) or getattr(item, 'docx', None)
+  elif isinstance(item, DAFileList):
+    if len(item.elements) != 1:
+      return None
+    item = item.elements[0]
+  if not isinstance(item, DAFile):
+    return None
+  return item
+
+def _pdf_path(item):
+  """
+  Return the path to the PDF version of a file-like item, or None if the item
+  is not already a PDF.
+  """
+  item = _single_file(item)
+  if item is None:
+    return None
+  path = item.path()
+  if path and path.lower().endswith('.pdf'):
+    return path
+  return None
+
+def _docx_to_pdf(item):
+  """
+  Convert a DOCX file-like item to a temporary PDF and return its path, or
+  None. word_to_pdf() uses docassemble's running LibreOffice listener when
+  `enable unoconv` is set in the configuration, so this does not start a new
+  office process for every document.
+  """
+  item = _single_file(item)
+  if item is None:
+    return None
+  path = item.path()
+  if not (path and path.lower().endswith('.docx')):
+    return None
+  out_file = tempfile.NamedTemporaryFile(prefix='aldocument', suffix='.pdf', delete=False)
+  out_file.close()
+  try:
+    if word_to_pdf(path, 'docx', out_file.name):
+      return out_file.name
+  except Exception as err:
+    log('Could not convert ' + str(path) + ' to PDF: ' + str(err))
+  os.remove(out_file.name)
+  return None
+
+def _files_fingerprint(files):
+  """
+  Return a hashable (path, modification time) tuple for the files, or None if
+  any of them cannot be located on disk.
+  """
+  fingerprint = []
+  try:
+    for item in files:
+      item = _single_file(item)
+      if item is None:
+        return None
+      path = item.path()
+      fingerprint.append((path, os.path.getmtime(path)))
+  except Exception:
+    return None
+  return tuple(fingerprint)
+
+# Upper limit on PDFs combined at the same time by as_pdf_list()
+max_concatenate_workers = 8
+
+def _merge_pdfs(paths, out_path):
+  """
+  Combine the PDFs at paths into out_path with pikepdf, in-process, instead of
+  shelling out to pdftk. Only touches files on disk, so it is safe to call from
+  a worker thread.
+  """
+  sources = []
+  try:
+    combined = pikepdf.Pdf.new()
+    for path in paths:
+      # Default access mode memory-maps the file where possible
+      source = pikepdf.Pdf.open(path)
+      sources.append(source)
+      combined.pages.extend(source.pages)
+    combined.save(out_path, linearize=False, object_stream_mode=pikepdf.ObjectStreamMode.generate)
+  finally:
+    for source in sources:
+      source.close()
+
+class _Concatenation(object):
+  """
+  One pending combination of files into a single PDF.
+
+  Create it and call result() in the interview's thread: docassemble keeps
+  the interview state in thread-local storage. Only run() may happen in a
+  worker thread.
+  """
+  def __init__(self, files, filename, pdf=None):
+    self.filename = filename
+    self.pdf = pdf
+    self.files = files
+    self.paths = None
+    self.error = None
+    self.converted = dict()
+    self.temp_paths = []
+    if pdf is None:
+      try:
+        self._use_files(files)
+      except:
+        self.discard()
+        raise
+
+  def _use_files(self, files):
+    """
+    Resolve the files to PDF paths, and allocate the output file if they can
+    be combined without pdf_concatenate().
+    """
+    self.files = files
+    if not use_fast_concatenate:
+      return
+    paths = [self._resolve_pdf(item) for item in files]
+    # A single PDF only needs to be copied, which does not need pikepdf
+    if paths and None not in paths and (len(paths) == 1 or pikepdf is not None):
+      self.paths = paths
+      self.pdf = DAFile()
+      self.pdf.set_random_instance_name()
+      self.pdf.initialize(filename=self.filename, extension='pdf')
+      self.out_path = self.pdf.path()
+
+  def _resolve_pdf(self, item):
+    """
+    Return a PDF path for the item. With pikepdf available, DOCX items are
+    converted here so they can be merged in-process instead of making the
+    whole job fall back to pdf_concatenate().
+    """
+    if id(item) in self.converted:
+      return self.converted[id(item)]
+    path = _pdf_path(item)
+    if path is None and pikepdf is not None:
+      path = _docx_to_pdf(item)
+      if path is not None:
+        self.temp_paths.append(path)
+    self.converted[id(item)] = path
+    return path
+
+  def _remove_temp_files(self):
+    for path in self.temp_paths:
+      try:
+        os.remove(path)
+      except OSError:
+        pass
+    self.temp_paths = []
+
+  def discard(self):
+    """
+    Release everything the job holds on to without producing a result, e.g.
+    when gathering the files raised an exception.
+    """
+    self._remove_temp_files()
+
+  def pending(self):
+    return self.paths is not None
+
+  def run(self):
+    try:
+      if len(self.paths) == 1:
+        shutil.copyfile(self.paths[0], self.out_path)
+      else:
+        _merge_pdfs(self.paths, self.out_path)
+    except Exception as err:
+      self.error = err
+
+  def result(self):
+    self._remove_temp_files()
+    if self.pending():
+      if self.error is None:
+        self.pdf.commit()
+        self.pdf.retrieve()
+        self.paths = None
+        return self.pdf
+      log('Falling back to pdf_concatenate for ' + str(self.filename) + ': ' + str(self.error))
+      self.paths = None
+      self.pdf = None
+    if self.pdf is None:
+      self.pdf = pdf_concatenate(list(self.files), filename=self.filename)
+    return self.pdf
+
+class _StreamedConcatenation(_Concatenation):
+  """
+  A _Concatenation that takes an iterator of files. Each PDF is opened and
+  appended in a background thread as soon as the iterator produces it, while
+  the interview thread goes on to render the next document.
+  """
+  def __init__(self, files, filename):
+    self.combined = None
+    self.sources = []
+    super().__init__((), filename)
+    try:
+      self._stream(files)
+    except:
+      # Usually docassemble asking for an attachment that is not assembled
+      # yet; the job will be built again from scratch
+      self.discard()
+      raise
+
+  def _stream(self, files):
+    """
+    Consume the iterator, appending each PDF to the combined document in
+    the background, then hand the collected files to _use_files().
+    """
+    if not (use_fast_concatenate and pikepdf is not None):
+      self._use_files(list(files))
+      return
+    collected = []
+    self.combined = pikepdf.Pdf.new()
+    streaming = True
+    with ThreadPoolExecutor(max_workers=1) as reader:
+      appends = []
+      for item in files:
+        collected.append(item)
+        if streaming:
+          path = self._resolve_pdf(item)
+          if path is None:
+            # Not a PDF and could not be converted here
+            streaming = False
+          else:
+            appends.append(reader.submit(self._append, path))
+      for append in appends:
+        try:
+          append.result()
+        except Exception as err:
+          self.error = err
+    if not streaming:
+      self._close()
+    self._use_files(collected)
+
+  def _append(self, path):
+    source = pikepdf.Pdf.open(path)
+    self.sources.append(source)
+    self.combined.pages.extend(source.pages)
+
+  def discard(self):
+    self._close()
+    super().discard()
+
+  def _close(self):
+    for source in self.sources:
+      source.close()
+    self.sources = []
+    self.combined = None
+
+  def run(self):
+    if self.combined is None or self.error is not None or len(self.paths) == 1:
+      self._close()
+      if self.error is None:
+        super().run()
+      return
+    try:
+      self.combined.save(self.out_path, linearize=False, object_stream_mode=pikepdf.ObjectStreamMode.generate)
+    except Exception as err:
+      self.error = err
+    finally:
+      self._close()
+
+def _run_concatenations(jobs):
+  """
+  Run the pikepdf merges of the jobs, overlapping them in a thread pool
+  when there is more than one.
+  """
+  pending = [job for job in jobs if job.pending()]
+  if len(pending) > 1:
+    with ThreadPoolExecutor(max_workers=min(max_concatenate_workers, len(pending))) as executor:
+      list(executor.map(lambda job: job.run(), pending))
+  else:
+    for job in pending:
+      job.run()
+
 def html_safe_str( the_string ):
   """
   Return a string that can be used as an html class or id
@@ -77,16 +518,33 @@ class ALAddendumField(DAObject):
     If newlines are preserved, we will use a heuristic to estimate line breaks instead
     of using absolute character limit.
     """
-    last_char = max(len(self.safe_value(overflow_message = overflow_message, input_width=input_width, preserve_newlines=True)) - (max(len(overflow_message)-1,0)), 0)   
-    
-    if preserve_newlines and isinstance(self.value_if_defined(),str):
-      # start where the safe value ends
-      return self.value_if_defined()[last_char:]
+    with _value_pass():
+      value = self.value_if_defined()
+      if isinstance(value, str):
+        # start where the safe value ends
+        last_char = max(len(self.safe_value(overflow_message = overflow_message, input_width=input_width, preserve_newlines=True)) - (max(len(overflow_message)-1,0)), 0)
+        return value[last_char:]
       
-    if isinstance(self.value_if_defined(),str):
-      return self.value_if_defined()[last_char:]
-    
-    return self.value_if_defined()[self.overflow_trigger:]
+      return value[self.overflow_trigger:]
+
+  def has_overflow(self):
+    """
+    Return True if the field has any overflow text or items. Resolves the
+    variable at most once.
+    """
+    with _value_pass():
+      value = self.value_if_defined()
+      if isinstance(value, str):
+        # Same shortcut as safe_value(): a short string without newlines always fits
+        if len(value) <= self.overflow_trigger and (value.count('\r') + value.count('\n')) == 0:
+          return False
+        return len(self.overflow_value()) > 0
+      if isinstance(value, DAList):
+        # overflow_value() is value[overflow_trigger:]; compare without slicing
+        return len(value.elements) > self.overflow_trigger
+      if isinstance(value, list):
+        return len(value) > self.overflow_trigger
+      return len(self.overflow_value()) > 0
 
   def max_lines(self, input_width=80, overflow_message_length=0):
     """
@@ -166,10 +624,16 @@ class ALAddendumField(DAObject):
     """
     Return the value of the field if it is defined, otherwise return an empty string.
     Addendum should never trigger docassemble's variable gathering.
+    
+    During a single overflow check or as_pdf() call, defined values of plain
+    variable names are remembered, so the checks only resolve each variable
+    once. Outside of those, every call reads the current value, so a field
+    that is gathered or reassigned later in the same request is picked up.
     """
-    if defined(self.field_name):
-      return value(self.field_name)
-    return ""
+    field_value = _lookup_field(self.field_name)
+    if field_value is _undefined:
+      return ""
+    return field_value
   
   def __str__(self):
     return str(self.value_if_defined())
@@ -178,8 +642,9 @@ class ALAddendumField(DAObject):
     """
     Return a list of the columns in this object.
     """
-    if hasattr(self, 'headers'):
-      return self.headers
+    headers = getattr(self, 'headers', None)
+    if headers is not None:
+      return headers
     else:
       # Use the first row as an exemplar
       try:
@@ -296,7 +761,7 @@ class ALAddendumFieldDict(DAOrderedDict):
     if not hasattr(self, 'style'):
       self.style = 'overflow_only'
     if hasattr(self, 'data'):
-      self.from_list(data)
+      self.from_list(self.data)
       del self.data      
   
   def initializeObject(self, *pargs, **kwargs):
@@ -306,12 +771,14 @@ class ALAddendumFieldDict(DAOrderedDict):
     """
     the_key = pargs[0]
     super().initializeObject(*pargs, **kwargs)
-    self[the_key].field_name = the_key
+    new_field = self[the_key]
+    new_field.field_name = the_key
+    return new_field
   
   def from_list(self, data):
     for entry in data:
+      # initializeObject() already sets field_name
       new_field = self.initializeObject(entry['field_name'], ALAddendumField)
-      new_field.field_name = entry['field_name']
       new_field.overflow_trigger = entry['overflow_trigger']
       
   def defined_fields(self, style='overflow_only'):
@@ -319,10 +786,30 @@ class ALAddendumFieldDict(DAOrderedDict):
     Return a filtered list of just the defined fields.
     If the "style" is set to overflow_only, only return the overflow values.
     """
-    if style == 'overflow_only':
-      return [field for field in self.values() if defined(field.field_name) and len(field.overflow_value())]
-    else:
-      return [field for field in self.values() if defined(field.field_name)]
+    with _value_pass():
+      return list(self._iter_defined_fields(style=style))
+  
+  def _raw_iter(self):
+    """
+    Iterate over (field_name, field) pairs of the underlying dictionary,
+    bypassing DAOrderedDict's iteration. Only for read-only internal use.
+    """
+    return iter(self.elements.items())
+
+  def _iter_defined_fields(self, style='overflow_only'):
+    """
+    Generator version of defined_fields(), for callers that can stop early.
+    """
+    # Keys are the field names (see initializeObject()), so undefined fields
+    # are skipped without touching the field objects at all
+    lookup = _lookup_field
+    overflow_only = style == 'overflow_only'
+    for field_name, field in self._raw_iter():
+      if lookup(field_name) is _undefined:
+        continue
+      if overflow_only and not field.has_overflow():
+        continue
+      yield field
   
   def overflow(self):
     return self.defined_fields(style='overflow_only')
@@ -363,24 +850,96 @@ class ALDocument(DADict):
     self.initializeAttribute('overflow_fields',ALAddendumFieldDict)
     if not hasattr(self, 'default_overflow_message'):
       self.default_overflow_message = ''
+    self._pdf_cache = dict()
  
+  # Enough for final/preview, each with and without the addendum
+  _pdf_cache_size = 4
+
+  def __setitem__(self, key, value):
+    self._clear_pdf_cache(key)
+    super().__setitem__(key, value)
+
+  def _clear_pdf_cache(self, key=None):
+    """
+    Forget cached PDFs built from the given key, or all cached PDFs.
+    """
+    cache = getattr(self, '_pdf_cache', None)
+    if not cache:
+      return
+    for cache_key in list(cache):
+      if key is None or cache_key[0] == key:
+        del cache[cache_key]
+
   def as_pdf(self, key='final'):
-    if self.filename.endswith('.pdf'):
-      ending = ''
-    else:
-      ending = '.pdf'
-    pdf = pdf_concatenate(self.as_list(key=key), filename=self.filename + ending)
+    with _value_pass():
+      job = self._pdf_job(key=key)
+    _run_concatenations([job])
+    return self._pdf_result(job)
+
+  def _pdf_job(self, key='final'):
+    """
+    Gather the files for as_pdf() and return the pending concatenation.
+    """
+    filename = self.filename
+    if not filename.endswith('.pdf'):
+      filename += '.pdf'
+    files = _document_files(self, key)
+    # Reuse the last PDF built from the same files as long as none of them
+    # has changed on disk
+    fingerprint = _files_fingerprint(files)
+    cache_key = None
+    cached = None
+    if fingerprint is not None:
+      if not hasattr(self, '_pdf_cache'):
+        self._pdf_cache = dict()
+      cache_key = (key, filename, fingerprint)
+      cached = self._pdf_cache.get(cache_key)
+    if cached is None and use_fast_concatenate and len(files) == 1 and _pdf_path(files[0]) is not None:
+      # A lone PDF that already has the right name can be used as it is.
+      # _pdf_result() sets .title on it, so only do this when that does not
+      # overwrite a different title.
+      source = _single_file(files[0])
+      if getattr(source, 'filename', None) == filename and getattr(source, 'title', self.title) == self.title:
+        cached = source
+    job = _Concatenation(files, filename, pdf=cached)
+    job.cache_key = cache_key
+    return job
+
+  def _pdf_result(self, job):
+    pdf = job.result()
     pdf.title = self.title
+    if job.cache_key is not None and job.cache_key not in self._pdf_cache:
+      while len(self._pdf_cache) >= self._pdf_cache_size:
+        del self._pdf_cache[next(iter(self._pdf_cache))]
+      self._pdf_cache[job.cache_key] = pdf
     return pdf
 
   def as_list(self, key='final'):
+    return list(self._as_tuple(key=key))
+
+  def _as_tuple(self, key='final'):
+    """
+    Same as as_list(), as a tuple, for internal callers that only iterate.
+    """
     if self.has_addendum and self.has_overflow():
-      return [self[key], self.addendum]
+      return (self[key], self.addendum)
     else:
-      return [self[key]]
+      return (self[key],)
     
+  def _expand_flat(self, leaves):
+    """
+    One step of ALDocumentBundle._enabled_leaves(): add this document if it
+    is enabled.
+    """
+    if self.enabled:
+      leaves.append(self)
+
   def has_overflow(self):
-    return len(self.overflow()) > 0
+    if not self.overflow_fields.elements:
+      return False
+    # Stop at the first field that overflows
+    with _value_pass():
+      return any(True for field in self.overflow_fields._iter_defined_fields(style='overflow_only'))
   
   def overflow(self):
     return self.overflow_fields.overflow()
@@ -423,39 +982,97 @@ class ALDocumentBundle(DAList):
     # self.initializeAttribute('templates', ALBundleList)
     
   def as_pdf(self, key='final'):
-    if self.filename.endswith('.pdf'):
-      ending = ''
-    else:
-      ending = '.pdf'
-    pdf = pdf_concatenate(self.as_flat_list(key=key), filename=self.filename + ending)
+    with _value_pass():
+      job = self._pdf_job(key=key)
+    _run_concatenations([job])
+    return self._pdf_result(job)
+  
+  def _pdf_job(self, key='final'):
+    """
+    Gather the files for as_pdf() and return the pending concatenation.
+    """
+    filename = self.filename
+    if not filename.endswith('.pdf'):
+      filename += '.pdf'
+    return _StreamedConcatenation(self._flat_iter(key=key), filename)
+
+  def _pdf_result(self, job):
+    pdf = job.result()
     pdf.title = self.title
     return pdf
   
   def preview(self):
     return self.as_pdf(key='preview')
+
+  def _raw_iter(self):
+    """
+    Iterate over the underlying list, bypassing DAList's iteration. Only for
+    read-only internal use.
+    """
+    return iter(self.elements)
   
   def as_flat_list(self, key='final'):
     """
     Returns the nested bundle as a single flat list.
     """
-    # Iterate through the list of self.templates
-    # If this is a simple document node, check if this individual template is enabled.
-    # Otherwise, call the bundle's as_list() method to show all enabled templates.
-    # Unpack the list of documents at each step so this can be concatenated into a single list
-    flat_list = []
-    for document in self:
-      if isinstance(document, ALDocumentBundle):
-        flat_list.extend(document.as_list(key=key))
-      elif document.enabled: # base case
-        flat_list.extend(document.as_list(key=key))
-                         
-    return flat_list
+    return list(self._flat_iter(key=key))
+
+  def _flat_iter(self, key='final'):
+    """
+    Generator version of as_flat_list().
+    """
+    for document in self._enabled_leaves():
+      # Asked fresh every time: whether the addendum is attached can change
+      # as soon as a field is gathered
+      yield from _document_files(document, key)
+
+  def _enabled_leaves(self):
+    """
+    Return the enabled documents of the nested bundle, in order.
+    """
+    leaves = []
+    # Each node expands itself: enabled bundles expand their children in
+    # order, enabled documents add themselves, and disabled nodes do nothing.
+    for document in self._raw_iter():
+      _expand_element(document, leaves)
+    return leaves
+
+  def _expand_flat(self, leaves):
+    """
+    One step of _enabled_leaves() for a nested bundle: expand the children of
+    an enabled bundle. A bundle is never a leaf itself.
+    """
+    if getattr(self, 'enabled', True):
+      for document in self._raw_iter():
+        _expand_element(document, leaves)
  
   def as_pdf_list(self, key='final'):
     """
     Returns the nested bundles as a list of PDFs that is only one level deep.
     """
-    return [document.as_pdf(key=key) for document in self]
+    # Documents are resolved in this thread, but their PDFs are combined
+    # in parallel. Documents that override as_pdf() are asked directly.
+    pdfs = []
+    documents = []
+    jobs = []
+    try:
+      with _value_pass():
+        for document in self._raw_iter():
+          if type(document).as_pdf in _job_as_pdf_methods:
+            pdfs.append(None)
+            documents.append((len(pdfs) - 1, document))
+            jobs.append(document._pdf_job(key=key))
+          else:
+            pdfs.append(document.as_pdf(key=key))
+      _run_concatenations(jobs)
+      for index, job in enumerate(jobs):
+        position, document = documents[index]
+        pdfs[position] = document._pdf_result(job)
+    except:
+      for job in jobs:
+        job.discard()
+      raise
+    return pdfs
   
   def as_pdf_list_table(self, key='final'):
     """
@@ -514,6 +1131,30 @@ class ALDocumentBundle(DAList):
     }
   </style>'''
     
+def _expand_element(document, leaves):
+  """
+  Add the enabled leaf documents under a bundle element to leaves. Elements
+  that are neither ALDocuments nor ALDocumentBundles are treated as documents
+  with an enabled attribute and as_list().
+  """
+  expand = getattr(document, '_expand_flat', None)
+  if expand is not None:
+    expand(leaves)
+  elif document.enabled:
+    leaves.append(document)
+
+def _document_files(document, key):
+  """
+  Return the files of a bundle element: ALDocument's tuple shortcut unless
+  the class overrides as_list(), otherwise whatever as_list() returns.
+  """
+  if type(document).as_list is ALDocument.as_list:
+    return document._as_tuple(key=key)
+  return document.as_list(key=key)
+
+# as_pdf() implementations that are split into _pdf_job() and _pdf_result()
+_job_as_pdf_methods = (ALDocument.as_pdf, ALDocumentBundle.as_pdf)
+
 class ALDocumentBundleDict(DADict):
   """
   A dictionary with named bundles of ALDocuments.